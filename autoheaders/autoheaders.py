@@ -15,28 +15,44 @@
 # You should have received a copy of the GNU General Public License
 # along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
 
+from . import cache
 from .errors import AutoheadersError, AutoheadersFileNotFoundError
 from .errors import AutoheadersFileWriteError
 from .generator import HeaderGenerator
 from .blockrepl import replace_blocks
 from .precpp import process_pre_cpp_text
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from typing import List
-import pkg_resources
+import json
 import os
 import os.path
+import re
 import shlex
+import shutil
 import subprocess
 import sys
+import traceback
 
 __version__ = "0.3.5"
 
 SHIM_NAME = "shim.h"
+CPP_CACHE_NAMESPACE = "cpp"
+CPP_SEARCH_DIRS_CACHE_NAMESPACE = "cpp-search-dirs"
+# Environment variables that add directories to the preprocessor's include
+# search path.
+INCLUDE_PATH_ENV_VARS = [
+    "CPATH", "C_INCLUDE_PATH", "CPLUS_INCLUDE_PATH", "OBJC_INCLUDE_PATH",
+]
 
 
 def get_shim_path() -> str:
     """Gets the path of shim.h.
     """
+    # Imported here because importing pkg_resources is slow.
+    import pkg_resources
     return pkg_resources.resource_filename(__name__, SHIM_NAME)
 
 
@@ -54,11 +70,9 @@ class CPPInvocationError(AutoheadersError):
         super().__init__(message)
 
 
+@lru_cache(maxsize=None)
 def cmd_in_path(cmd):
-    return subprocess.run(
-        ["which", cmd], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    ).returncode == 0
+    return shutil.which(cmd) is not None
 
 
 def find_fake_headers_dir(c_path: str) -> str:
@@ -69,6 +83,19 @@ def find_fake_headers_dir(c_path: str) -> str:
     :returns: The path to the .fake-headers/ directory, or ``None``.
     """
     dirname = os.path.dirname(os.path.realpath(c_path or ""))
+    return find_fake_headers_dir_from(dirname)
+
+
+@lru_cache(maxsize=1024)
+def find_fake_headers_dir_from(dirname: str) -> str:
+    """Tries to find a .fake-headers/ directory in ``dirname`` or any of its
+    parent directories. Results are cached, as C files in the same directory
+    share the same .fake-headers/ directory; call ``cache_clear()`` on this
+    function to discard them.
+
+    :param dirname: The absolute path of the directory to search first.
+    :returns: The path to the .fake-headers/ directory, or ``None``.
+    """
     while True:
         fake_headers_path = os.path.join(dirname, ".fake-headers")
         if os.path.isdir(fake_headers_path):
@@ -118,27 +145,290 @@ def get_base_cpp_args() -> List[str]:
     )
 
 
-def run_preprocessor(
-        c_path: str, c_text: bytes, cpp_args: List[str] = None) -> bytes:
-    """Runs the C preprocessor.
+def get_cpp_command(c_path: str, cpp_args: List[str] = None) -> List[str]:
+    """Gets the full command used to run the C preprocessor.
 
     :param c_path: The path to the current C file.
-    :param c_text: The contents of the C file. This text may have already
-      been processed (e.g., by :func:`precpp.process_pre_cpp_text`), but
-      the line numbers should match the line numbers actually present in
-      the C file.
     :param cpp_args: Additional arguments for the preprocessor.
-    :returns: The preprocessed C code.
+    :returns: The command, as a list of arguments.
     """
+    # Note: Options like "-fdirectives-only" can't be used here. Macros must
+    # be fully expanded, as shim.h works by defining macros, and comments
+    # must be removed, as pycparser can't parse them.
     all_args = get_base_cpp_args()
     all_args.append("-")
     all_args += ["-include", get_shim_path()]
     all_args += ["-DHEADER", "-DPRIVATE_HEADER", "-DANY_HEADER"]
     all_args += get_cpp_fake_headers_args(c_path)
     all_args += (cpp_args or [])
+    return all_args
+
+
+linemarker_regex = re.compile(rb"""
+    ^ \# \s* \d+ \s* "((?: \\. | [^\\"])*)"
+""", re.VERBOSE | re.MULTILINE)
+
+linemarker_escape_regex = re.compile(rb"\\(.)")
+
+
+def get_cpp_dependencies(preprocessed: bytes) -> List[str]:
+    """Gets the paths of the files read by the C preprocessor, as listed in
+    the linemarkers in its output.
+    """
+    # Most files are named by many linemarkers, so unescape each name once.
+    matches = linemarker_regex.finditer(preprocessed)
+    names = {match.group(1) for match in matches}
+    deps = set()
+    for name in names:
+        path = linemarker_escape_regex.sub(rb"\1", name)
+        # Skip "<stdin>", "<built-in>", etc.
+        if not path.startswith(b"<"):
+            deps.add(os.fsdecode(path))
+    return sorted(deps)
+
+
+def _stat_dependency(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+cpp_missing_dir_regex = re.compile(rb"""
+    ignoring \s nonexistent \s directory \s "(.*)"
+""", re.VERBOSE)
+
+
+def get_cpp_search_dirs(all_args: List[str], cwd: str = None) -> List[str]:
+    """Gets the directories that the C preprocessor searches for included
+    files, including directories that don't exist. This is determined from
+    the output of the preprocessor's ``-v`` option.
+
+    :param all_args: The command used to run the preprocessor.
+    :param cwd: The working directory in which the preprocessor is run.
+    :returns: The directories, or ``None`` if they couldn't be determined.
+    """
+    try:
+        proc = subprocess.run(
+            all_args + ["-v"], input=b"", stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, cwd=cwd,
+        )
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+
+    # Quoted includes in the C file (which is read from stdin) are looked up
+    # in the working directory first.
+    dirs = [os.curdir]
+    in_list = False
+    found_list = False
+    for line in proc.stderr.splitlines():
+        match = cpp_missing_dir_regex.match(line)
+        if match:
+            dirs.append(os.fsdecode(match.group(1)))
+        elif line.endswith(b"search starts here:"):
+            in_list = True
+        elif line == b"End of search list.":
+            in_list = False
+            found_list = True
+        elif in_list and line.startswith(b" "):
+            path = line[1:]
+            if path.endswith(b" (framework directory)"):
+                path = path.rsplit(b" ", 2)[0]
+            dirs.append(os.fsdecode(path))
+    return dirs if found_list else None
+
+
+def get_cached_cpp_search_dirs(
+        all_args: List[str], cwd: str = None) -> List[str]:
+    """Like :func:`get_cpp_search_dirs`, but uses the cache if it is
+    enabled. The search directories don't depend on the input, so the
+    preprocessor only has to be run with ``-v`` once for each command,
+    working directory, and set of include path environment variables.
+    """
+    if not cache.cache_enabled():
+        return get_cpp_search_dirs(all_args, cwd)
+    executable = shutil.which(all_args[0])
+    key = cache.make_key(
+        *_get_cpp_config_key_parts(all_args, cwd),
+        # Invalidate the cache when the preprocessor is upgraded.
+        json.dumps([executable, _stat_dependency(executable or "")]).encode()
+    )
+    cached = cache.get(CPP_SEARCH_DIRS_CACHE_NAMESPACE, key)
+    if cached is not None:
+        try:
+            return json.loads(cached.decode())
+        except ValueError:
+            pass
+    search_dirs = get_cpp_search_dirs(all_args, cwd)
+    if search_dirs is not None:
+        cache.put(
+            CPP_SEARCH_DIRS_CACHE_NAMESPACE, key,
+            json.dumps(search_dirs).encode(),
+        )
+    return search_dirs
+
+
+def get_shadowing_paths(
+        search_dirs: List[str], deps: List[str],
+        cwd: str = None) -> List[str]:
+    """Gets the paths at which a new file could change which files the C
+    preprocessor includes, by shadowing an included file that was found
+    later in the search path.
+
+    :param search_dirs: The preprocessor's search directories, as returned
+      by :func:`get_cpp_search_dirs`.
+    :param deps: The files read by the preprocessor, as returned by
+      :func:`get_cpp_dependencies`.
+    :param cwd: The working directory in which the preprocessor was run.
+    :returns: The paths, none of which currently exist.
+    """
+    # Quoted includes are looked up in the directory of the file that
+    # contains them before the search directories.
+    dep_dirs = sorted({os.path.dirname(dep) or os.curdir for dep in deps})
+    paths = set()
+    for dep in deps:
+        for i, base in enumerate(search_dirs):
+            if base == os.curdir and not os.path.isabs(dep):
+                name = dep
+            elif dep.startswith(os.path.join(base, "")):
+                name = dep[len(os.path.join(base, "")):]
+            else:
+                continue
+            # "name" is what the include directive may have contained;
+            # a file with that name in an earlier directory would be used
+            # instead.
+            for earlier in dep_dirs + search_dirs[:i]:
+                paths.add(os.path.join(earlier, name))
+    # Files that already exist weren't included (e.g., "./stdio.h" isn't
+    # searched for <stdio.h>), so they can't shadow anything.
+    return sorted(
+        path for path in paths
+        if not os.path.exists(os.path.join(cwd or "", path))
+    )
+
+
+def _get_cpp_config_key_parts(
+        all_args: List[str], cwd: str) -> List[bytes]:
+    env = [
+        name if os.getenv(name) is None else
+        "{}={}".format(name, os.getenv(name))
+        for name in INCLUDE_PATH_ENV_VARS
+    ]
+    return [
+        os.fsencode(os.path.abspath(cwd or os.curdir)),
+        b"\0".join(map(os.fsencode, all_args)),
+        b"\0".join(map(os.fsencode, env)),
+    ]
+
+
+def get_cpp_cache_key(
+        all_args: List[str], c_text: bytes, cwd: str = None) -> str:
+    """Gets the key under which the output of the C preprocessor is cached.
+    The key depends on the command, working directory, include path
+    environment variables, and input.
+    """
+    return cache.make_key(*_get_cpp_config_key_parts(all_args, cwd), c_text)
+
+
+def _stats_unchanged(stats, cwd: str) -> bool:
+    return all(
+        _stat_dependency(os.path.join(cwd or "", path)) == stat
+        for path, stat in stats
+    )
+
+
+def get_cached_cpp_output(key: str, cwd: str = None) -> bytes:
+    """Gets cached output from a previous run of the C preprocessor with the
+    same command, working directory, include path environment variables, and
+    input. The cached output is used only if none of the files it depends on
+    have changed, and no new file would be included in place of one of them.
+
+    :param key: The cache key, as returned by :func:`get_cpp_cache_key`.
+    :param cwd: The working directory in which the preprocessor is run.
+    :returns: The preprocessed C code, or ``None``.
+    """
+    if not cache.cache_enabled():
+        return None
+    entry = cache.get(CPP_CACHE_NAMESPACE, key)
+    if entry is None:
+        return None
+    manifest, _, preprocessed = entry.partition(b"\n")
+    try:
+        manifest = json.loads(manifest.decode())
+        files, absent = manifest["files"], manifest["absent"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not _stats_unchanged(files, cwd):
+        return None
+    if any(os.path.exists(os.path.join(cwd or "", p)) for p in absent):
+        return None
+    return preprocessed
+
+
+def put_cached_cpp_output(
+        key: str, all_args: List[str], preprocessed: bytes, cwd: str = None):
+    """Caches the output of the C preprocessor. See
+    :func:`get_cached_cpp_output`. Nothing is cached if the cache is
+    disabled, or if the preprocessor's search directories can't be
+    determined.
+
+    :param key: The cache key, as returned by :func:`get_cpp_cache_key`.
+    :param all_args: The command used to run the preprocessor.
+    :param preprocessed: The output of the preprocessor.
+    :param cwd: The working directory in which the preprocessor was run.
+    """
+    if not cache.cache_enabled():
+        return
+    search_dirs = get_cached_cpp_search_dirs(all_args, cwd)
+    if search_dirs is None:
+        return
+    paths = get_cpp_dependencies(preprocessed)
+    absent = get_shadowing_paths(search_dirs, paths, cwd)
+    executable = shutil.which(all_args[0])
+    if executable is not None:
+        # Invalidate the cache when the preprocessor is upgraded.
+        paths.append(executable)
+    manifest = json.dumps({
+        "files": [
+            [path, _stat_dependency(os.path.join(cwd or "", path))]
+            for path in paths
+        ],
+        "absent": absent,
+    }).encode()
+    cache.put(CPP_CACHE_NAMESPACE, key, manifest + b"\n" + preprocessed)
+
+
+def run_preprocessor(
+        c_path: str, c_text: bytes, cpp_args: List[str] = None,
+        cwd: str = None) -> bytes:
+    """Runs the C preprocessor, or gets its output from the cache if it has
+    already been run with the same input.
+
+    :param c_path: The path to the current C file.
+    :param c_text: The contents of the C file. This text may have already
+      been processed (e.g., by :func:`precpp.process_pre_cpp_text`), but
+      the line numbers should match the line numbers actually present in
+      the C file.
+    :param cpp_args: Additional arguments for the preprocessor.
+    :param cwd: The working directory in which to run the preprocessor.
+      If ``None``, the current working directory is used.
+    :returns: The preprocessed C code.
+    """
+    all_args = get_cpp_command(c_path, cpp_args)
+    # Hashing the input is skipped entirely when the cache is disabled.
+    key = None
+    if cache.cache_enabled():
+        key = get_cpp_cache_key(all_args, c_text, cwd)
+        cached = get_cached_cpp_output(key, cwd)
+        if cached is not None:
+            return cached
     try:
         proc = subprocess.run(
             all_args, check=True, stdout=subprocess.PIPE, input=c_text,
+            cwd=cwd,
         )
     except subprocess.CalledProcessError as e:
         raise CPPInvocationError(
@@ -150,6 +440,8 @@ def run_preprocessor(
             "Error running the C preprocessor: "
             "Could not locate executable: {}".format(all_args[0])
         ) from e
+    if key is not None:
+        put_cached_cpp_output(key, all_args, proc.stdout, cwd)
     return proc.stdout
 
 
@@ -164,21 +456,15 @@ def preprocess(
     :param cpp_args: Additional arguments for the preprocessor.
     :returns: The preprocessed C code.
     """
-    chdir_success = c_path is not None
-    if chdir_success:
-        cwd = os.getcwd()
-        try:
-            os.chdir(os.path.dirname(c_path))
-        except FileNotFoundError:
-            chdir_success = False
+    # The preprocessor runs in the C file's directory so that relative
+    # paths (e.g., in "-c" arguments) are resolved relative to it.
+    cwd = os.path.dirname(c_path) if c_path is not None else None
+    if not (cwd and os.path.isdir(cwd)):
+        cwd = None
 
-    try:
-        c_text = process_pre_cpp_text(c_text)
-        c_text = run_preprocessor(c_path, c_text, cpp_args)
-        return replace_blocks(c_text)
-    finally:
-        if chdir_success:
-            os.chdir(cwd)
+    c_text = process_pre_cpp_text(c_text)
+    c_text = run_preprocessor(c_path, c_text, cpp_args, cwd)
+    return replace_blocks(c_text)
 
 
 def _read_file(c_path):
@@ -244,3 +530,45 @@ def generate_headers(opts: AutoheadersOpts):
     if opts.private_outpath:
         with _open_outfile(opts.private_outpath) as f:
             gen.write_all(f, private=True)
+
+
+def _generate_headers_worker(opts: AutoheadersOpts, debug: bool) -> str:
+    # Some exception types can't be pickled, so only the message (or, in
+    # debug mode, the formatted traceback) is sent back to the parent
+    # process.
+    try:
+        generate_headers(opts)
+    except AutoheadersError as e:
+        return traceback.format_exc().rstrip() if debug else e.message
+    return None
+
+
+def generate_headers_many(
+        opts_list: List[AutoheadersOpts], max_workers: int = None,
+        debug: bool = False):
+    """Generates header files from multiple C source code files. The files
+    are processed in parallel in separate processes.
+
+    :param opts_list: Options for each invocation of autoheaders.
+    :param max_workers: The maximum number of processes to use. If ``None``,
+      the number of processors on the machine is used.
+    :param debug: If true, the error for each file includes the traceback
+      from the process in which the error occurred.
+    :raises AutoheadersError: If an error occurs for any of the files.
+      Headers are still generated for the other files.
+    """
+    if len(opts_list) <= 1:
+        for opts in opts_list:
+            generate_headers(opts)
+        return
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        messages = list(executor.map(
+            _generate_headers_worker, opts_list, repeat(debug),
+        ))
+    errors = [
+        "{}:\n{}".format(opts.c_path, message)
+        for opts, message in zip(opts_list, messages) if message is not None
+    ]
+    if errors:
+        raise AutoheadersError("\n\n".join(errors))
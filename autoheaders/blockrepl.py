@@ -42,30 +42,31 @@ class BlockReplacementParseError(BaseParseError):
 
 def find_statement_end(text, pos):
     braces = 0
-    for i in range(pos, len(text)):
-        if text[i] == b"{"[0]:
-            braces += 1
-        elif text[i] == b"}"[0]:
-            braces -= 1
-        elif braces > 0:
-            pass
-        elif text[i] == b";"[0]:
-            return i
+    i = pos
+    while True:
+        end = text.find(b";", i)
+        if end < 0:
+            break
+        braces += text.count(b"{", i, end) - text.count(b"}", i, end)
+        if braces <= 0:
+            return end
+        i = end + 1
     raise BlockReplacementParseError.with_header(
         "Reached end of file while searching for statement end", pos)
 
 
 def find_closing_brace(text, pos):
     braces = 1
-    for i in range(pos, len(text)):
-        if text[i] == b"{"[0]:
-            braces += 1
-            continue
-        if text[i] != b"}"[0]:
-            continue
-        braces -= 1
+    i = pos
+    while True:
+        end = text.find(b"}", i)
+        if end < 0:
+            break
+        # Only opening braces can appear between `i` and `end`.
+        braces += text.count(b"{", i, end) - 1
         if braces <= 0:
-            return i
+            return end
+        i = end + 1
     raise BlockReplacementParseError.with_header(
         "Reached end of file while searching for closing brace", pos)
 
@@ -88,13 +89,11 @@ string_regex = re.compile(rb"""
 
 
 def get_strings(text):
-    strings = []
     for match in string_regex.finditer(text):
-        start, end = match.start(1), match.end(1)
+        start, end = match.span(1)
         if start < 0:
             continue
-        strings.append((start, end))
-    return strings
+        yield (start, end)
 
 
 def replace_strings(text: bytes) -> bytes:
@@ -103,15 +102,19 @@ def replace_strings(text: bytes) -> bytes:
     :param text: The code.
     :returns: The code with string literals replaced.
     """
-    parts = []
+    view = memoryview(text)
+    result = bytearray()
     pos = 0
     for start, end in get_strings(text):
-        parts.append(text[pos:start+1])
-        parts.append(b"\n" * text.count(b"\n", start, end))
-        parts.append(text[end-1:end])
+        result += view[pos:start+1]
+        # String literals very rarely span multiple lines.
+        newlines = text.count(b"\n", start, end)
+        if newlines:
+            result += b"\n" * newlines
+        result += view[end-1:end]
         pos = end
-    parts.append(text[pos:])
-    return b"".join(parts)
+    result += view[pos:]
+    return bytes(result)
 
 
 class BlockParser:
@@ -125,8 +128,9 @@ class BlockParser:
         "union": rb"\b union \s",
         "openbrace": rb"{",
         "assignment": rb"\b = \b",
-        "preproc": rb"^ \# .*? $ \n?",
-    }, re.MULTILINE | re.DOTALL)
+        # Consecutive preprocessor lines are consumed in a single match.
+        "preproc": rb"(?: ^ \# [^\n]* \n?)+",
+    }, re.MULTILINE | re.DOTALL, first_chars=b"tseu{=#")
 
     def __init__(self, text):
         self.text = text
@@ -134,60 +138,80 @@ class BlockParser:
         self.blocks = []
 
     def parse_iter(self):
+        """Advances to the next top-level construct.
+
+        :returns: The ``(start, end)`` position of the block that was found,
+          or ``None``.
+        """
         extype, match = self.regex.search(self.text, self.pos)
         if extype is None:
             self.pos = len(self.text)
-            return
+            return None
         self.pos = match.end()
 
         if extype in self.statement_types:
             self.pos = find_statement_end(self.text, self.pos) + 1
-            return
+            return None
 
         if extype is self.regex.types.openbrace:
             end = find_closing_brace(self.text, self.pos)
-            self.blocks.append((self.pos, end))
+            block = (self.pos, end)
             self.pos = end
-            return
+            return block
+        return None
+
+    def iter_blocks(self):
+        """Like :meth:`parse`, but yields each block as soon as it is found.
+        """
+        length = len(self.text)
+        while self.pos < length:
+            block = self.parse_iter()
+            if block is not None:
+                yield block
 
     def parse(self):
-        while self.pos < len(self.text):
-            self.parse_iter()
+        self.blocks.extend(self.iter_blocks())
         return self.blocks
 
 
-BlockParser.statement_types = [BlockParser.regex.types[name] for name in [
-    "typedef", "struct", "enum", "union", "assignment",
-]]
-
-
-non_preproc_regex = re.compile(rb"""
-    (?: ^ | (?<= \n))  # Start of line
-    [^#\n] [^\n]*?     # Non-preproc line
-    (?: $ | (?= \n))   # End of line
-""", re.VERBOSE)
+BlockParser.statement_types = frozenset(
+    BlockParser.regex.types[name] for name in [
+        "typedef", "struct", "enum", "union", "assignment",
+    ]
+)
 
 
 def replace_non_preproc(text):
-    return non_preproc_regex.sub(rb"", text)
+    """Removes the contents of all lines that aren't preprocessor directives.
+    Newlines are kept.
+    """
+    return b"\n".join(
+        line if line.startswith(b"#") else b""
+        for line in text.split(b"\n")
+    )
 
 
 def replace_blocks_from_list(text, blocks):
-    parts = []
+    view = memoryview(text)
+    result = bytearray()
     pos = 0
     for start, end in blocks:
-        parts.append(text[pos:start])
-        parts.append(replace_non_preproc(text[start:end]))
+        result += view[pos:start]
+        if text.find(b"#", start, end) < 0:
+            # Fast path: nothing in the block needs to be kept.
+            result += b"\n" * text.count(b"\n", start, end)
+        else:
+            result += replace_non_preproc(text[start:end])
         pos = end
-    parts.append(text[pos:])
-    return b"".join(parts)
+    result += view[pos:]
+    return bytes(result)
 
 
 def replace_blocks_nostr(text: bytes) -> bytes:
     """Replaces blocks without replacing string literals. Called by
     :func:`replace_blocks`.
     """
-    blocks = BlockParser(text).parse()
+    blocks = BlockParser(text).iter_blocks()
     return replace_blocks_from_list(text, blocks)
 
 
@@ -0,0 +1,148 @@
+# Copyright (C) 2018 taylor.fish <contact@taylor.fish>
+#
+# This file is part of autoheaders.
+#
+# autoheaders is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# autoheaders is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A simple on-disk cache for intermediate results, such as preprocessed C code.
+"""
+
+import hashlib
+import os
+import os.path
+import tempfile
+
+CACHE_ENV_VAR = "AUTOHEADERS_CACHE"
+
+# The maximum total size of the items in each namespace, in bytes. When it
+# is exceeded, the least recently used items are removed.
+MAX_NAMESPACE_SIZE = 256 * 1024 * 1024
+
+
+def cache_enabled() -> bool:
+    """Checks whether the cache is enabled. The cache is disabled unless the
+    ``AUTOHEADERS_CACHE`` environment variable is set to a value other than
+    ``0``.
+    """
+    return os.getenv(CACHE_ENV_VAR, "0") not in ["", "0"]
+
+
+def get_cache_dir() -> str:
+    """Gets the directory in which cached data is stored.
+    """
+    base = os.getenv("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "autoheaders")
+
+
+def make_key(*parts: bytes) -> str:
+    """Makes a cache key by hashing the given byte strings.
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        # Include the length so that different splits hash differently.
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def _get_path(namespace: str, key: str) -> str:
+    return os.path.join(get_cache_dir(), namespace, key)
+
+
+def get(namespace: str, key: str) -> bytes:
+    """Gets an item from the cache.
+
+    :param namespace: The kind of item (e.g., ``"cpp"``).
+    :param key: The key of the item, as returned by :func:`make_key`.
+    :returns: The cached data, or ``None`` if it isn't present.
+    """
+    if not cache_enabled():
+        return None
+    path = _get_path(namespace, key)
+    try:
+        with open(path, "rb") as f:
+            value = f.read()
+    except OSError:
+        return None
+    try:
+        # Mark the item as recently used; see `prune`.
+        os.utime(path)
+    except OSError:
+        pass
+    return value
+
+
+def put(namespace: str, key: str, value: bytes):
+    """Adds an item to the cache. Errors are ignored, as the cache is only an
+    optimization.
+
+    :param namespace: The kind of item (e.g., ``"cpp"``).
+    :param key: The key of the item, as returned by :func:`make_key`.
+    :param value: The data to store.
+    """
+    if not cache_enabled():
+        return
+    path = _get_path(namespace, key)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        # Atomic, so concurrent readers never see a partial file.
+        os.replace(tmp_path, path)
+    except OSError:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        return
+    prune(namespace)
+
+
+def prune(namespace: str, max_size: int = None):
+    """Removes the least recently used items in a namespace until the total
+    size of its items is at most ``max_size``. Errors are ignored.
+
+    :param namespace: The kind of item (e.g., ``"cpp"``).
+    :param max_size: The maximum total size, in bytes. If ``None``,
+      `MAX_NAMESPACE_SIZE` is used.
+    """
+    if max_size is None:
+        max_size = MAX_NAMESPACE_SIZE
+    entries = []
+    try:
+        dir_entries = list(os.scandir(_get_path(namespace, "")))
+    except OSError:
+        return
+    for entry in dir_entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
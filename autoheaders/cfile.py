@@ -16,8 +16,11 @@
 # along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
 
 from .cparser import SimpleCParser, DeclEnd
+from array import array
+from functools import lru_cache
 from itertools import islice
 from typing import List
+import bisect
 import math
 import re
 
@@ -26,17 +29,31 @@ HEADER_MACRO = b"HEADER"
 PRIVATE_HEADER_MACRO = b"PRIVATE_HEADER"
 ANY_HEADER_MACRO = b"ANY_HEADER"
 HEADER_MACROS = [HEADER_MACRO, PRIVATE_HEADER_MACRO, ANY_HEADER_MACRO]
+# The macros that mark a header block in public and private headers.
+PUBLIC_HEADER_BLOCK_MACROS = frozenset([ANY_HEADER_MACRO, HEADER_MACRO])
+PRIVATE_HEADER_BLOCK_MACROS = frozenset([
+    ANY_HEADER_MACRO, PRIVATE_HEADER_MACRO,
+])
 
 GUARD_COMMENT = b"@guard"
 INCLUDE_COMMENT = b"@include"
 
+leading_whitespace_regex = re.compile(rb"[ \t]*")
+indentation_unit_regex = re.compile(rb"\t+ | [ ]+", re.VERBOSE)
+
+
+@lru_cache(maxsize=64)
+def _get_indentation_regex(whitespace: bytes):
+    return re.compile(rb"^" + re.escape(whitespace), re.MULTILINE)
+
 
 def remove_leading_indentation(bytestr: bytes):
     """Removes leading indentation (indentation common to all lines).
     """
-    whitespace = re.match(rb"[ \t]*", bytestr).group(0)
-    whitespace_re = re.escape(whitespace)
-    return re.sub(rb"^" + whitespace_re, rb"", bytestr, flags=re.MULTILINE)
+    whitespace = leading_whitespace_regex.match(bytestr).group(0)
+    if not whitespace:
+        return bytestr
+    return _get_indentation_regex(whitespace).sub(rb"", bytestr)
 
 
 def normalize_indentation(bytestr: bytes, reference_line: bytes):
@@ -48,33 +65,50 @@ def normalize_indentation(bytestr: bytes, reference_line: bytes):
     two units), the indentation is repeatedly collapsed until there are no
     gaps.
     """
-    match = re.match(rb"\t+ | [ ]+", reference_line or b"", re.VERBOSE)
+    match = indentation_unit_regex.match(reference_line or b"")
     if not match:
         return remove_leading_indentation(bytestr)
     indentation_unit = match.group(0)
 
+    # The indentation unit consists of a single repeated character, so the
+    # indent of each line can be measured with lstrip().
+    unit_char = indentation_unit[:1]
+    unit_len = len(indentation_unit)
     lines = bytestr.splitlines(keepends=True)
-    base_lines = []
+    indents = []
     for line in lines:
-        indent, base_line = re.fullmatch(
-            rb"((?: %s)*) (.*) $" % (re.escape(indentation_unit),),
-            line, re.DOTALL | re.VERBOSE,
-        ).groups()
-        base_lines.append((len(indent), base_line))
+        indent_chars = len(line) - len(line.lstrip(unit_char))
+        indents.append(indent_chars - indent_chars % unit_len)
 
-    indent_sizes = sorted(list({indent for indent, _ in base_lines}))
+    indent_sizes = sorted(set(indents))
     indent_map = {size: new_size for new_size, size in enumerate(indent_sizes)}
-    return b"".join(
-        (indentation_unit * indent_map[indent_size]) + base_line
-        for indent_size, base_line in base_lines
-    )
+    parts = []
+    for line, indent in zip(lines, indents):
+        parts.append(indentation_unit * indent_map[indent])
+        # Avoid copying the rest of the line until the final join.
+        parts.append(memoryview(line)[indent:])
+    return b"".join(parts)
 
 
 class CSourceFile:
+    __slots__ = [
+        "parser", "private", "preproc_if_starts", "preproc_if_ends",
+        "comment_before_cache",
+    ]
+
     def __init__(self, text, private=False):
         self.parser = SimpleCParser(text)
         self.parser.parse_metadata()
         self.private = private
+        # Top-level preprocessor conditionals don't overlap, so they're
+        # sorted by both their start and end positions.
+        self.preproc_if_starts = array(
+            "q", (start for start, _ in self.preproc_ifs),
+        )
+        self.preproc_if_ends = array("q", (end for _, end in self.preproc_ifs))
+        # Public and private headers both need the comments before the
+        # same declarations, so cache them by line number.
+        self.comment_before_cache = {}
 
     @property
     def text(self):
@@ -146,19 +180,8 @@ class CSourceFile:
         )
 
     def get_comment_pos_before(self, pos):
-        start, end = 0, len(self.comments)
-        while start < end:
-            middle = (start + end) // 2
-            comment_start, comment_end = self.comments[middle]
-
-            if comment_end < pos:
-                start = middle + 1
-                continue
-            if comment_end > pos:
-                end = middle
-                continue
-            start = end = middle
-        return None if start < 1 else self.comments[start - 1]
+        index = bisect.bisect_left(self.parser.comment_ends, pos)
+        return None if index < 1 else self.comments[index - 1]
 
     def get_comment_pos_directly_before(self, pos):
         comment_pos = self.get_comment_pos_before(pos)
@@ -190,20 +213,29 @@ class CSourceFile:
     def get_comment_before(self, lineno: int) -> bytes:
         """Gets the comment, if any, before the specified line.
         """
+        comment = self.comment_before_cache.get(lineno)
+        if comment is not None:
+            return comment
         pos = self.line_to_pos(lineno)
         start = self.get_min_comment_start_directly_before(pos)
         if start is None:
-            return b""
-        start = self.get_line_start(start)
-        end = self.get_line_start(pos)
-        return self.text[start:end]
+            comment = b""
+        else:
+            start = self.get_line_start(start)
+            end = self.get_line_start(pos)
+            comment = self.text[start:end]
+        self.comment_before_cache[lineno] = comment
+        return comment
 
     def header_preproc_match(self, string):
-        match = re.fullmatch(rb"ifdef (.*)", string)
-        return match and match.group(1) in [
-            ANY_HEADER_MACRO,
-            PRIVATE_HEADER_MACRO if self.private else HEADER_MACRO,
-        ]
+        prefix = b"ifdef "
+        if not string.startswith(prefix):
+            return False
+        macros = (
+            PRIVATE_HEADER_BLOCK_MACROS if self.private else
+            PUBLIC_HEADER_BLOCK_MACROS
+        )
+        return string[len(prefix):] in macros
 
     def get_header_chunks(
             self, start_lineno: int, end_lineno: int) -> List[bytes]:
@@ -222,7 +254,7 @@ class CSourceFile:
         chunks = []
         preproc_ifs = islice(
             self.preproc_ifs,
-            self.parser.get_first_preproc_if_after(range_start), None,
+            bisect.bisect_left(self.preproc_if_starts, range_start), None,
         )
 
         for start_pos, end_pos in preproc_ifs:
@@ -244,10 +276,21 @@ class CSourceFile:
 
         :returns: The macro name specified in the comment, or ``None``.
         """
-        for start_pos, end_pos in self.comments:
+        prefix = GUARD_COMMENT + b" "
+        # Only check the comments that contain the prefix at all.
+        pos = self.text.find(prefix)
+        while pos >= 0:
+            index = bisect.bisect_right(self.parser.comment_ends, pos)
+            if index >= len(self.comments):
+                break
+            start_pos, end_pos = self.comments[index]
+            if start_pos > pos:
+                pos = self.text.find(prefix, start_pos)
+                continue
             comment_text = self.text[start_pos:end_pos].strip()
-            if comment_text.startswith(GUARD_COMMENT + b" "):
+            if comment_text.startswith(prefix):
                 return comment_text.split(b" ", 1)[1]
+            pos = self.text.find(prefix, end_pos)
         return None
 
     def is_in_preproc_cond(self, lineno: int):
@@ -255,7 +298,7 @@ class CSourceFile:
         conditional.
         """
         pos = self.line_to_pos(lineno)
-        for start_pos, end_pos in self.preproc_ifs:
-            if start_pos <= pos < end_pos:
-                return True
-        return False
+        index = bisect.bisect_right(self.preproc_if_starts, pos) - 1
+        if index < 0:
+            return False
+        return pos < self.preproc_if_ends[index]
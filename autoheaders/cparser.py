@@ -1,8 +1,7 @@
-from .parser import Parser, ParseError
-from .orregex import OrRegex
+from .parser import Parser, ParseError, bytes_repr
 
+from array import array
 from collections import namedtuple
-import bisect
 import re
 
 
@@ -14,15 +13,12 @@ DeclEnd = namedtuple("DeclEnd", ["position", "is_definition"])
 
 
 class SimpleCParser(Parser):
+    __slots__ = ["comments", "comment_ends", "preproc_ifs"]
+
     re_preproc_if = re.compile(rb"""
         (if|ifdef|ifndef) \s
     """, re.VERBOSE)
 
-    re_preproc_next = OrRegex({
-        "start": rb"^ [^\S\n]* \# (?: if|ifdef|ifndef) \s",
-        "end": rb"^ [^\S\n]* \#endif\b",
-    }, re.MULTILINE)
-
     re_rest_of_line = re.compile(rb"""
         (\\. | [^\\\n])* \n?
     """, re.VERBOSE)
@@ -35,13 +31,28 @@ class SimpleCParser(Parser):
         (\\. | [^\\'])* [']
     """, re.VERBOSE | re.DOTALL)
 
-    re_source_line = re.compile(rb"""
-        ^ [^\S\n]* \S+ .* $
-    """, re.VERBOSE | re.MULTILINE)
+    # Maps the character that starts a definition to a regex that finds
+    # either that character, a semicolon, or a character that could start a
+    # nested construct.
+    re_decl_end = {
+        def_char: re.compile(rb"[;/#\"'({\[%s]" % re.escape(def_char))
+        for def_char in [b"=", b"{"]
+    }
+
+    re_metadata_next = re.compile(rb"[/#\"'({\[]")
+
+    # Maps a closing character to a regex that finds either that character
+    # or a character that could start a nested construct.
+    re_read_until = {
+        closing: re.compile(rb"[/#\"'({\[%s]" % re.escape(closing))
+        for closing in [b")", b"}", b"]"]
+    }
 
     def __init__(self, text):
         super().__init__(text)
         self.comments = []
+        # The end position of each comment in `comments`, for searching.
+        self.comment_ends = array("q")
         self.preproc_ifs = []
 
     def raise_exc(self, message, line, col):
@@ -53,15 +64,42 @@ class SimpleCParser(Parser):
         self.i = match.end()
 
     def read_until_match(self, string):
-        while not self.accept(string):
+        regex = self.re_read_until.get(string)
+        if regex is None:
+            while not self.accept(string):
+                self.read_single()
+            return
+
+        # Skip directly to the next byte that could be either the end of the
+        # construct or the start of something `read_single` needs to handle.
+        text = self.text
+        # Each closing string in `re_read_until` is a single byte, and a
+        # match is never at the end of the file, so the closing byte can be
+        # checked directly instead of with `accept`.
+        closing = string[0]
+        while True:
+            match = regex.search(text, self.i)
+            if match is None:
+                self.i = len(text)
+                self.error(
+                    "Unexpected end of file while searching for " +
+                    bytes_repr(string),
+                )
+            self.i = match.start()
+            if text[self.i] == closing:
+                self.i += 1
+                return
             self.read_single()
 
     def line_comment(self):
         self.read_rest_of_line()
 
     def block_comment(self):
-        while not self.accept(b"*/"):
-            self.advance(1)
+        end = self.text.find(b"*/", self.i)
+        if end < 0:
+            self.i = len(self.text)
+            self.error("Unexpected end of file while searching for '*/'")
+        self.i = end + len(b"*/")
 
     def non_cond_preproc(self):
         try:
@@ -69,21 +107,54 @@ class SimpleCParser(Parser):
         except ValueError:
             self.i = len(self.text)
 
+    def find_next_preproc_cond(self):
+        """Finds the next ``#if``, ``#ifdef``, ``#ifndef``, or ``#endif``
+        directive that starts a line (optionally after whitespace).
+
+        :returns: A tuple, where the first item is whether or not the
+          directive is ``#endif``, and the second item is the position of
+          the ``#``, or ``None`` if no directive was found.
+        """
+        text = self.text
+        pos = self.i
+        while True:
+            pos = text.find(b"#", pos)
+            if pos < 0:
+                return (False, None)
+            line_start = text.rfind(b"\n", 0, pos) + 1
+            pos += 1
+            if line_start < self.i or text[line_start:pos-1].strip():
+                continue
+            for name in [b"endif", b"if", b"ifdef", b"ifndef"]:
+                if not text.startswith(name, pos):
+                    continue
+                after = text[pos+len(name):pos+len(name)+1]
+                if name == b"endif":
+                    if not (after.isalnum() or after == b"_"):
+                        return (True, pos - 1)
+                elif after.isspace():
+                    return (False, pos - 1)
+
     def cond_preproc(self):
         """Called when an if, ifdef, or ifndef preprocessor directive is found.
         """
         start = self.i
         self.read_rest_of_line()
+        # The number of conditionals that haven't been closed yet.
+        depth = 1
         while True:
-            extype, match = self.re_preproc_next.search(self.text, self.i)
-            if match is None:
+            is_end, pos = self.find_next_preproc_cond()
+            if pos is None:
                 self.error("Expected '#endif'")
-            if extype == self.re_preproc_next.types.end:
-                self.i = match.end()
-                return (start, self.i)
-            self.i = self.text.index(b"#", match.start())
-            self.cond_preproc()
-        raise RuntimeError("Unexpected end of loop")
+            if is_end:
+                self.i = pos + len(b"#endif")
+                depth -= 1
+                if depth == 0:
+                    return (start, self.i)
+                continue
+            self.i = pos
+            self.read_rest_of_line()
+            depth += 1
 
     def preproc(self):
         """Called when a preprocessor directive is found.
@@ -114,44 +185,53 @@ class SimpleCParser(Parser):
         self.read_until_match(b"]")
 
     def read_single(self):
-        if self.accept(b"//"):
-            self.line_comment()
-            return
-
-        if self.accept(b"/*"):
-            self.block_comment()
-            return
-
-        func = {
-            b"#": self.preproc,
-            b'"': self.string_literal,
-            b"'": self.char_literal,
-            b"(": self.paren,
-            b"{": self.brace,
-            b"[": self.bracket
-        }.get(self.get(1))
-        self.advance(1)
-        func and func()
+        char = self.text[self.i]
+        if char == b"/"[0]:
+            if self.text.startswith(b"//", self.i):
+                self.i += len(b"//")
+                self.line_comment()
+                return
+            if self.text.startswith(b"/*", self.i):
+                self.i += len(b"/*")
+                self.block_comment()
+                return
+
+        self.i += 1
+        func = self.read_single_funcs.get(char)
+        func and func(self)
+
+    def find_decl_end(self, def_char: bytes) -> DeclEnd:
+        """Finds the next top-level ";" or ``def_char``.
+        """
+        text = self.text
+        regex = self.re_decl_end[def_char]
+        end_chars = (def_char[0], b";"[0])
+        while True:
+            # Skip directly to the next byte that could be the end of the
+            # declaration or the start of a construct `read_single` handles.
+            match = regex.search(text, self.i)
+            if match is None:
+                self.i = len(text)
+                self.error("Unexpected end of file")
+            self.i = match.start()
+            char = text[self.i]
+            if char in end_chars:
+                break
+            self.read_single()
+        self.i += 1
+        return DeclEnd(self.i - 1, char == end_chars[0])
 
     def find_var_decl_end(self) -> DeclEnd:
         """Find the end of a variable declaration, or the "=" in a variable
         definition.
         """
-        while self.get(1) not in b"=;":
-            self.read_single()
-        is_def = self.get(1) == b"="
-        self.advance(1)
-        return DeclEnd(self.i - 1, is_def)
+        return self.find_decl_end(b"=")
 
     def find_func_decl_end(self) -> DeclEnd:
         """Finds the end of a function declaration, or the "{" in a function
         definition.
         """
-        while self.get(1) not in b"{;":
-            self.read_single()
-        is_def = self.get(1) == b"{"
-        self.advance(1)
-        return DeclEnd(self.i - 1, is_def)
+        return self.find_decl_end(b"{")
 
     def add_comment(self, start_pos: int, end_pos: int):
         """Adds a comment to the list of comments in the C file.
@@ -163,6 +243,7 @@ class SimpleCParser(Parser):
           (`//`, ``/*``, or ``*/``).
         """
         self.comments.append((start_pos, end_pos))
+        self.comment_ends.append(end_pos)
 
     def top_block_comment(self):
         """Called when a top-level "/* ... */" comment is found.
@@ -187,15 +268,27 @@ class SimpleCParser(Parser):
         self.preproc_ifs.append((start, end))
 
     def parse_metadata_iter(self):
-        if self.accept(b"/*"):
-            self.top_block_comment()
-            return
-
-        if self.accept(b"//"):
-            self.top_line_comment()
+        # Everything other than these characters would just be skipped by
+        # `read_single`, so jump straight to the next one.
+        text = self.text
+        match = self.re_metadata_next.search(text, self.i)
+        if match is None:
+            self.i = len(text)
             return
-
-        if self.accept(b"#"):
+        self.i = match.start()
+
+        char = text[self.i]
+        if char == b"/"[0]:
+            if text.startswith(b"/*", self.i):
+                self.i += len(b"/*")
+                self.top_block_comment()
+                return
+            if text.startswith(b"//", self.i):
+                self.i += len(b"//")
+                self.top_line_comment()
+                return
+        elif char == b"#"[0]:
+            self.i += 1
             self.top_preproc()
             return
 
@@ -205,7 +298,10 @@ class SimpleCParser(Parser):
         """Parses metadata (comments and preprocessor directives)
         in the C file.
         """
-        while not self.done:
+        # Equivalent to checking `self.done`, without a property call for
+        # every construct.
+        length = len(self.text)
+        while self.i < length:
             self.parse_metadata_iter()
 
     def get_next_source_line(self) -> bytes:
@@ -213,13 +309,31 @@ class SimpleCParser(Parser):
 
         :returns: The text of the line.
         """
-        match = self.re_source_line.search(self.text, self.i)
-        if not match:
-            return None
-        return match.group(0)
-
-    def get_first_preproc_if_after(self, pos: int) -> int:
-        """Gets the index of the next preprocessor conditional after the
-        specific position.
-        """
-        return bisect.bisect_left(self.preproc_ifs, (pos, 0))
+        text = self.text
+        start = self.i
+        if start > 0 and text[start-1:start] != b"\n":
+            start = text.find(b"\n", start) + 1
+            if start == 0:
+                return None
+        while start < len(text):
+            end = text.find(b"\n", start)
+            if end < 0:
+                end = len(text)
+            line = text[start:end]
+            if line.strip():
+                return line
+            start = end + 1
+        return None
+
+
+# Maps the first byte of a construct to the (unbound) method that reads the
+# rest of it. Built once so that `read_single` doesn't have to create a new
+# dict of bound methods for every byte it reads.
+SimpleCParser.read_single_funcs = {
+    b"#"[0]: SimpleCParser.preproc,
+    b'"'[0]: SimpleCParser.string_literal,
+    b"'"[0]: SimpleCParser.char_literal,
+    b"("[0]: SimpleCParser.paren,
+    b"{"[0]: SimpleCParser.brace,
+    b"["[0]: SimpleCParser.bracket,
+}
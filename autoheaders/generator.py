@@ -18,12 +18,17 @@
 from .cfile import CSourceFile
 from .errors import BaseParseError
 
-from pycparser import c_parser, c_ast, plyparser
+from collections import namedtuple
+from functools import lru_cache
 from typing import BinaryIO
 import codecs
+import io
 import locale
 import re
 
+# pycparser is imported only when C code is actually parsed, as importing it
+# takes a significant portion of autoheaders' startup time.
+
 
 class PycParseError(BaseParseError):
     def __init__(self, message, pyc_exc=None):
@@ -35,6 +40,9 @@ class MetadataParseError(BaseParseError):
     pass
 
 
+# The locale isn't changed while headers are generated, so the encoding
+# only needs to be looked up once.
+@lru_cache(maxsize=1)
 def get_default_encoding():
     encoding = locale.getpreferredencoding()
     try:
@@ -47,34 +55,78 @@ def get_default_encoding():
 
 
 def get_ast(preproc_str: str):
+    from pycparser import c_parser, plyparser
     parser = c_parser.CParser()
     try:
         return parser.parse(preproc_str)
     except plyparser.ParseError as e:
         raise PycParseError("Error parsing C file:\n{}".format(e), e) from e
+    finally:
+        # PLY's modules keep the most recently created lexer and parser
+        # alive, and with them the parsed text and the parser's stacks
+        # (which refer to the AST). Clear those so that the text and AST
+        # can be freed once they're no longer needed.
+        parser.clex.input("")
+        parser.cparser.restart()
+
+
+linemarker_regex = re.compile(rb"""
+    ^ \# [^\S\n]* \d+ [^\S\n]* "((?: \\. | [^\\"\n])*)" [^\n]* \n?
+""", re.VERBOSE | re.MULTILINE)
+
+source_line_regex = re.compile(rb"""
+    ^ [^\S\n]* [^\s\#]
+""", re.VERBOSE | re.MULTILINE)
+
+
+def has_source_code(preprocessed: bytes) -> bool:
+    """Checks whether any code in preprocessed C code comes from the source
+    file itself (the file named by the first linemarker), rather than from
+    included files. If not, the file has no declarations to put in the
+    header, and parsing it can be skipped.
+    """
+    markers = list(linemarker_regex.finditer(preprocessed))
+    if not markers:
+        return True
+    source_file = markers[0].group(1)
+    ends = [marker.start() for marker in markers[1:]] + [len(preprocessed)]
+    return any(
+        source_line_regex.search(preprocessed, marker.end(), end)
+        for marker, end in zip(markers, ends)
+        if marker.group(1) == source_file
+    )
+
 
+preproc_filename_regex = re.compile(rb"""
+    \s* \# \s* \d+? \s* "(.*?)"
+""", re.VERBOSE)
 
-def get_preproc_filename(preproc_str: str):
-    match = re.match(r"""
-        \s* \# \s* \d+? \s* "(.*?)"
-    """, preproc_str, re.VERBOSE)
+
+def get_preproc_filename(preprocessed: bytes, encoding: str):
+    """Gets the source filename from the linemarker at the start of
+    preprocessed C code. Only the filename is decoded.
+    """
+    match = preproc_filename_regex.match(preprocessed)
     if not match:
         raise MetadataParseError(
             'Expected to find source filename at the start of the '
             'preprocessed file (in the format: # 1 "<filename>")',
         )
-    filename = match.group(1).replace(r'\"', r'"')
+    filename = match.group(1).decode(encoding).replace(r'\"', r'"')
     return filename
 
 
-class HeaderGenerator(c_ast.NodeVisitor):
+# A declaration that should be written to the public or private header.
+FoundDecl = namedtuple("FoundDecl", ["lineno", "is_static", "is_func"])
+
+
+class HeaderGenerator:
     """Generates a header file from C code.
 
     :param c_text: The (non-preprocessed) C code.
     :param preprocessed: The preprocessed C code.
     """
     def __init__(self, c_text: bytes, preprocessed: bytes):
-        super().__init__()
         self._outfile = None
         self._private = None
         self.cfile = CSourceFile(c_text)
@@ -85,6 +137,9 @@ class HeaderGenerator(c_ast.NodeVisitor):
         self._in_func_def = False
         self._preproc_filename = None
         self._ast = None
+        # Declarations found in the AST. The AST is traversed only once, and
+        # the declarations are shared by the public and private headers.
+        self._decls = None
 
         # Line number of the most recent declaration that was processed.
         self.last_decl_lineno: int = None
@@ -111,7 +166,10 @@ class HeaderGenerator(c_ast.NodeVisitor):
         self._first = True
 
     def write_raw(self, text):
-        self.outfile.write(text.replace(b"\r\n", b"\n"))
+        # Most files don't use CRLF line endings, so avoid copying the text.
+        if b"\r" in text:
+            text = text.replace(b"\r\n", b"\n")
+        self.outfile.write(text)
 
     def write_chunk(self, text):
         if not self._first:
@@ -136,19 +194,34 @@ class HeaderGenerator(c_ast.NodeVisitor):
             raise RuntimeError(
                 "Source filename has not been set from preprocessed metadata",
             )
+        # Like pycparser's `c_ast.NodeVisitor`, which isn't used as a base
+        # class so that pycparser can be imported lazily, nodes are handled
+        # by the `visit_<NodeType>` method, if any. Other nodes are ignored.
+        func = self.visit_funcs.get(node.__class__.__name__)
+        if func is None:
+            return
         matching_path = self._preproc_filename
         if node.coord is not None and node.coord.file != matching_path:
             return
-        super().visit(node)
+        func(self, node)
 
-    def generic_visit(self, node):
-        pass
-
-    def visit_children(self, node):
-        for _, child in node.children():
-            self.visit(child)
+    def _visit_nodes(self, nodes):
+        """Visits each of ``nodes``. Equivalent to calling :meth:`visit` for
+        each node, but nodes that would be ignored (most of the top-level
+        nodes from included files) are skipped without a method call.
+        """
+        visit_funcs = self.visit_funcs
+        matching_path = self._preproc_filename
+        for node in nodes:
+            func = visit_funcs.get(node.__class__.__name__)
+            if func is None:
+                continue
+            if node.coord is not None and node.coord.file != matching_path:
+                continue
+            func(self, node)
 
-    visit_FileAST = visit_children
+    def visit_FileAST(self, node):
+        self._visit_nodes(node.ext)
 
     def visit_Decl(self, node):
         self._decl = node
@@ -167,37 +240,20 @@ class HeaderGenerator(c_ast.NodeVisitor):
     def on_var_decl(self):
         if "extern" in self._decl.storage:
             return
-        is_static = "static" in self._decl.storage
-        if is_static != self.private:
-            return
-
-        lineno = self._decl.coord.line
-        if self.cfile.is_in_preproc_cond(lineno):
-            return
-
-        self.write_decl_chunk(
-            self.cfile.make_plain_var_decl(lineno)
-            if self.private else
-            self.cfile.make_extern_var_decl(lineno),
-            lineno
-        )
-        self.last_decl_lineno = lineno
+        self.add_decl(is_func=False)
 
     def visit_FuncDecl(self, node):
         if not self._in_func_def:
             return
         self._in_func_def = False
+        self.add_decl(is_func=True)
 
-        is_static = "static" in self._decl.storage
-        if is_static != self.private:
-            return
-
+    def add_decl(self, is_func: bool):
         lineno = self._decl.coord.line
         if self.cfile.is_in_preproc_cond(lineno):
             return
-
-        self.write_decl_chunk(self.cfile.make_func_decl(lineno), lineno)
-        self.last_decl_lineno = lineno
+        is_static = "static" in self._decl.storage
+        self._decls.append(FoundDecl(lineno, is_static, is_func))
 
     def visit_FuncDef(self, node):
         self._in_func_def = True
@@ -205,12 +261,37 @@ class HeaderGenerator(c_ast.NodeVisitor):
         self._in_func_def = False
 
     def load_ast(self):
-        preproc_str = self.preprocessed.decode(get_default_encoding())
-        self._ast = get_ast(preproc_str)
-        self._preproc_filename = get_preproc_filename(preproc_str)
+        encoding = get_default_encoding()
+        if has_source_code(self.preprocessed):
+            self._ast = get_ast(self.preprocessed.decode(encoding))
+        self._preproc_filename = get_preproc_filename(
+            self.preprocessed, encoding,
+        )
+
+    def find_decls(self):
+        if self._decls is not None:
+            return
+        self._decls = []
+        if self._ast is not None:
+            self.visit(self._ast)
+        # Only the declarations are needed to write the headers, so don't
+        # keep the AST and preprocessed code alive while they're written.
+        self._ast = None
+        self.preprocessed = None
 
     def write_from_ast(self):
-        self.visit(self._ast)
+        self.find_decls()
+        for lineno, is_static, is_func in self._decls:
+            if is_static != self.private:
+                continue
+            if is_func:
+                decl = self.cfile.make_func_decl(lineno)
+            elif self.private:
+                decl = self.cfile.make_plain_var_decl(lineno)
+            else:
+                decl = self.cfile.make_extern_var_decl(lineno)
+            self.write_decl_chunk(decl, lineno)
+            self.last_decl_lineno = lineno
 
     def write_guard_start(self, guard_name=None):
         if self.private:
@@ -232,11 +313,26 @@ class HeaderGenerator(c_ast.NodeVisitor):
         """Writes a complete header file.
 
         :param outfile: The open binary file to which to write the output.
+          The header is written with a single call to ``outfile.write``.
         :param private: Whether or not to generate a private header.
         """
-        self.outfile, self.private = outfile, private
+        # The header is built from many small pieces, so collect them in
+        # memory rather than writing each one to a possibly unbuffered file.
+        buffer = io.BytesIO()
+        self.outfile, self.private = buffer, private
         guard = self.write_guard_start()
         self.write_from_ast()
         self.write_remaining_marked_chunks()
         if guard:
             self.write_guard_end()
+        outfile.write(buffer.getvalue())
+
+
+# Maps the name of each type of AST node to the method that handles it. Every
+# method named "visit_<NodeType>" is included, so helper methods must not use
+# that prefix.
+HeaderGenerator.visit_funcs = {
+    name[len("visit_"):]: func
+    for name, func in vars(HeaderGenerator).items()
+    if name.startswith("visit_")
+}
@@ -15,7 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
 
-from .autoheaders import __version__, generate_headers, AutoheadersOpts
+from .autoheaders import __version__, generate_headers, generate_headers_many
+from .autoheaders import AutoheadersOpts
 from .errors import AutoheadersError
 from collections import namedtuple
 import os.path
@@ -24,12 +25,17 @@ import sys
 
 USAGE = """\
 Usage:
-  {0} [options] [--] <c-file>
+  {0} [options] [--] <c-file>...
   {0} -h | --help | --version
 
 Arguments:
   <c-file>  The C source code file from which to generate the header.
             If "-", read from standard input (unless preceded by "--").
+            If multiple files are given, they are processed in parallel,
+            and each header is written next to its C file as <name>.h (or
+            <name>.priv.h with "-p"). "-o" can't be used in this case, and
+            only one kind of header (public, or private with "-p") is
+            generated per run.
 
 Options:
   -p --private  Generate a private header file containing static declarations.
@@ -53,6 +59,13 @@ def stderr(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
+long_option_regex = re.compile(r"--[^-]")
+short_option_regex = re.compile(r"-[^-]")
+# Matches each comma-separated argument in a "-c" option.
+cpp_arg_regex = re.compile(r"(?: ^|,) ((?: \\. | [^,])*)", re.VERBOSE)
+backslash_escape_regex = re.compile(r"\\(.)")
+
+
 def get_bin_name(argv):
     if argv and argv[0]:
         return os.path.basename(argv[0])
@@ -70,18 +83,42 @@ def usage(bin_name, exit_code: int = 1):
         sys.exit(exit_code)
 
 
+def get_default_outpath(c_path: str, private: bool) -> str:
+    """Gets the path of the header generated from ``c_path`` when multiple
+    C files are given.
+    """
+    base = os.path.splitext(c_path)[0]
+    return base + (".priv.h" if private else ".h")
+
+
 def run(args: "ParsedArgs"):
     """Runs the program.
 
     :param args: The arguments for the program.
     """
-    opts = AutoheadersOpts()
-    opts.c_path = args.c_file
-    opts.outpath = args.outfile
-    opts.private_outpath = args.private_outfile
-    opts.cpp_args = args.cpp_args
-    opts.private = args.private
-    generate_headers(opts)
+    if len(args.c_files) == 1:
+        opts = AutoheadersOpts()
+        opts.c_path = args.c_files[0]
+        opts.outpath = args.outfile
+        opts.private_outpath = args.private_outfile
+        opts.cpp_args = args.cpp_args
+        opts.private = args.private
+        generate_headers(opts)
+        return
+
+    opts_list = []
+    for c_file in args.c_files:
+        opts = AutoheadersOpts()
+        opts.c_path = c_file
+        opts.cpp_args = args.cpp_args
+        opts.private = args.private
+        outpath = get_default_outpath(c_file, args.private)
+        if args.private:
+            opts.private_outpath = outpath
+        else:
+            opts.outpath = outpath
+        opts_list.append(opts)
+    generate_headers_many(opts_list, debug=args.debug)
 
 
 def run_or_exit(args: "ParsedArgs", debug: bool = False):
@@ -124,8 +161,8 @@ class ParsedArgs:
         self.debug = False
         self.help = False
         self.version = False
-        # If None, code is read from stdin.
-        self.c_file = None
+        # A None item means code is read from stdin.
+        self.c_files = []
         self.cpp_args = []
 
         self.outfile = None
@@ -195,11 +232,15 @@ class ArgParser:
         if cpp_arg is None:
             self.error('Expected argument after "-c".')
             return
+        if "\\" not in cpp_arg:
+            # Fast path: no escapes, so every comma separates arguments.
+            self.parsed.cpp_args += cpp_arg.split(",")
+            return
         self.parsed.cpp_args += [
             # Interpret backslash escapes.
-            re.sub(r"\\(.)", r"\1", arg.group(1)) for arg in
+            backslash_escape_regex.sub(r"\1", arg.group(1)) for arg in
             # Parse comma-separated options with backslash escapes.
-            re.finditer(r"(?: ^|,) ((?: \\. | [^,])*)", cpp_arg, re.VERBOSE)
+            cpp_arg_regex.finditer(cpp_arg)
         ]
 
     # Parses a "-o" option.
@@ -241,21 +282,18 @@ class ArgParser:
         if arg == "--":
             self.options_done = True
             return True
-        if re.match(r"--[^-]", arg):
+        if long_option_regex.match(arg):
             self.parse_long_option(arg)
             return True
-        if re.match(r"-[^-]", arg):
+        if short_option_regex.match(arg):
             self.parse_short_option(arg)
             return True
         return False
 
     def parse_positional(self):
         arg = self.arg
-        if self.positional_index == 0:
-            c_file = None if arg == "-" and not self.options_done else arg
-            self.parsed.c_file = c_file
-            return
-        self.error("Unexpected positional argument: {}".format(arg))
+        c_file = None if arg == "-" and not self.options_done else arg
+        self.parsed.c_files.append(c_file)
 
     def parse_single(self):
         if not self.options_done and self.try_parse_option():
@@ -272,9 +310,50 @@ class ArgParser:
             return
         if self.positional_index < 1:
             self.error("Missing required positional argument: <c-file>")
+        if len(parsed.c_files) > 1:
+            if parsed.outfile or parsed.private_outfile:
+                self.error('"-o" cannot be used with multiple C files.')
+            elif None in parsed.c_files:
+                self.error('"-" cannot be used with multiple C files.')
+            else:
+                self.check_outpaths()
         if parsed.private and parsed.outfile and not parsed.private_outfile:
             stderr('Warning: "-p" has no effect on earlier "-o" option.')
 
+    def check_outpaths(self):
+        """Checks that, when multiple C files are given, no header would
+        overwrite one of the C files or another header.
+        """
+        parsed = self.parsed
+        c_files = {}
+        for c_file in parsed.c_files:
+            real_path = os.path.realpath(c_file)
+            if real_path in c_files:
+                self.error('"{}" was specified more than once.'.format(
+                    c_file,
+                ))
+                return
+            c_files[real_path] = c_file
+        outpaths = {}
+        for c_file in parsed.c_files:
+            outpath = get_default_outpath(c_file, parsed.private)
+            real_path = os.path.realpath(outpath)
+            if real_path in c_files:
+                self.error(
+                    '"{}" would be overwritten by the header generated from '
+                    '"{}".'.format(c_files[real_path], c_file)
+                )
+                return
+            if real_path in outpaths:
+                self.error(
+                    'The headers generated from "{}" and "{}" would both be '
+                    'written to "{}".'.format(
+                        outpaths[real_path], c_file, outpath,
+                    )
+                )
+                return
+            outpaths[real_path] = c_file
+
     def parse(self):
         while not self.done:
             self.parse_single()
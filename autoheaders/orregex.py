@@ -28,11 +28,14 @@ class OrRegex:
     For each name, an attribute with the name is added to the `types`
     attribute. Each of these sub-attributes in the `types` attribute is an
     enumeration value returned by :meth:`search`.
+    :param first_chars: If provided, every match of every expression must
+    begin with one of these characters. Positions that start with any other
+    character are skipped quickly, without trying each expression.
     """
-    def __init__(self, expression_map: Dict[str, bytes], flags=0):
-        expression_tuples = list(expression_map.items())
-        type_names = [k for k, v in expression_tuples]
-        expressions = [v for k, v in expression_tuples]
+    def __init__(
+            self, expression_map: Dict[str, bytes], flags=0,
+            first_chars: bytes = None):
+        type_names = list(expression_map)
 
         """The types of regular expressions. Each sub-attribute of this
         attribute is a name specified in the ``expression_map`` parameter in
@@ -42,7 +45,11 @@ class OrRegex:
         self.types = Enum("OrRegexType", type_names)
 
         self.type_list = list(self.types)
-        self.regex = self.make_pattern(expressions, flags)
+        # Maps each group name (see `make_pattern`) to its type.
+        self.type_map = {type_.name: type_ for type_ in self.types}
+        self.regex = self.make_pattern(expression_map, flags, first_chars)
+        if self.regex.groups != len(self.types):
+            raise RuntimeError("Group count mismatch")
 
     def search(self, text: bytes, start: int = 0) -> Tuple[Enum, Any]:
         """Performs a search for any of the regular expressions provided
@@ -59,24 +66,21 @@ class OrRegex:
         match = self.regex.search(text, start)
         if match is None:
             return None, None
-
-        groups = match.groups()
-        if len(groups) != len(self.types):
-            raise RuntimeError("Group count mismatch")
-
-        i = 1
-        while True:
-            try:
-                group_start = match.start(i)
-            except IndexError as e:
-                raise RuntimeError("No groups were matched") from e
-            if group_start >= 0:
-                return self.type_list[i - 1], match
-            i += 1
+        # Each expression is the only group in its alternative, so the last
+        # group that matched is the expression that matched.
+        if match.lastgroup is None:
+            raise RuntimeError("No groups were matched")
+        return self.type_map[match.lastgroup], match
 
     @classmethod
-    def make_pattern(cls, expressions, flags):
-        return re.compile(
-            rb"|".join(b"(%s\n)" % (pattern,) for pattern in expressions),
-            flags | re.VERBOSE,
+    def make_pattern(cls, expression_map, flags, first_chars=None):
+        pattern = rb"|".join(
+            b"(?P<%s>%s\n)" % (name.encode(), p)
+            for name, p in expression_map.items()
         )
+        if first_chars:
+            pattern = rb"(?= [%s]) (?: %s)" % (
+                b"".join(re.escape(bytes([c])) for c in first_chars),
+                pattern,
+            )
+        return re.compile(pattern, flags | re.VERBOSE)
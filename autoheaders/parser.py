@@ -16,18 +16,22 @@
 # along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
 
 from .errors import BaseParseError
+from array import array
 from bisect import bisect_right
 
 
-def _build_line_map_gen(text):
-    yield 0
-    for i, char in enumerate(text):
-        if char == b"\n"[0]:
-            yield i + 1
-
-
 def build_line_map(text):
-    return list(_build_line_map_gen(text))
+    # Positions are stored as machine integers rather than a list of int
+    # objects to keep the table small for large files. The table is sized
+    # up front, and each newline is found with `find`, so neither the
+    # table nor a copy of the lines has to be built up piece by piece.
+    linemap = array("q", [0]) * (text.count(b"\n") + 1)
+    find = text.find
+    pos = 0
+    for i in range(1, len(linemap)):
+        pos = find(b"\n", pos) + 1
+        linemap[i] = pos
+    return linemap
 
 
 def bytes_repr(bytestr):
@@ -56,12 +60,22 @@ class ParseError(BaseParseError):
 class Parser:
     """A generic bytestring parser.
     """
+    __slots__ = ["text", "i", "_linemap"]
+
     def __init__(self, text):
         if not text.endswith(b"\n"):
             text += b"\n"
         self.text = text
         self.i = 0
-        self.linemap = build_line_map(text)
+        self._linemap = None
+
+    @property
+    def linemap(self):
+        # Only needed for line numbers, so it isn't built until a line
+        # number or position is actually looked up.
+        if self._linemap is None:
+            self._linemap = build_line_map(self.text)
+        return self._linemap
 
     def line_to_pos(self, lineno):
         return self.linemap[max(lineno, 1) - 1]
@@ -71,13 +85,13 @@ class Parser:
         return lineno
 
     def get_line_start(self, pos):
-        return self.text.rfind(b"\n", 0, pos) + 1
+        return self.linemap[bisect_right(self.linemap, pos) - 1]
 
     def get_line_end(self, pos):
-        try:
-            return self.text.index(b"\n", pos)
-        except ValueError:
-            return len(self.text)
+        # Lines are short, so finding the next newline directly is cheaper
+        # than a search of the line map.
+        end = self.text.find(b"\n", pos)
+        return len(self.text) if end < 0 else end
 
     @property
     def location(self):
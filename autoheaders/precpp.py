@@ -52,8 +52,12 @@ def coords_from_pos(text, pos):
 class IncludeParser:
     """Parses ``#include`` statements in a C file.
     """
+    __slots__ = [
+        "text", "scan_regex", "pos", "preproc_level",
+        "preproc_is_header_block_stack", "includes",
+    ]
 
-    regex = OrRegex({
+    expressions = {
         "string": rb"""
             ["] (?: [\\]? .)*? ["]
         """,
@@ -71,21 +75,22 @@ class IncludeParser:
             // [^\n]*
         """,
 
+        # Equivalent to `/[*] .*? [*]/`, but consumes runs of non-"*"
+        # characters at once instead of trying to end the comment after
+        # every character.
         "block_comment": rb"""
-            /[*] .*? [*]/
+            /[*] [^*]* [*]+ (?: [^/*] [^*]* [*]+ )* /
         """
-    }, re.DOTALL)
+    }
 
-    preproc_if_regex = re.compile(rb"""
-        (?: if | ifdef | ifndef)\s
-    """, re.VERBOSE)
-
-    preproc_endif_regex = re.compile(rb"""
-        endif (?: \s | $)
-    """, re.VERBOSE)
+    regex = OrRegex(expressions, re.DOTALL, first_chars=b"\"'/# \t\r\v\f")
 
-    preproc_include_regex = re.compile(rb"""
-        include \s
+    # Identifies the directives that matter with a single match; the name
+    # of the group that matched is the type of directive.
+    preproc_directive_regex = re.compile(rb"""
+        (?P<if> (?: if | ifdef | ifndef)\s) |
+        (?P<endif> endif (?: \s | $)) |
+        (?P<include> include \s)
     """, re.VERBOSE)
 
     preproc_header_block_regex = re.compile(
@@ -97,6 +102,10 @@ class IncludeParser:
 
     def __init__(self, text):
         self.text = text
+        self.scan_regex = self.regex
+        if b"/*" not in text and b"//" not in text:
+            # No comments can match, so use the smaller regex.
+            self.scan_regex = self.regex_no_comments
         self.pos = 0
         self.preproc_level = 0
         self.preproc_is_header_block_stack = [False]
@@ -119,32 +128,50 @@ class IncludeParser:
         return self.preproc_is_header_block_stack[-1]
 
     def parse_iter(self):
-        extype, match = self.regex.search(self.text, self.pos)
+        """Advances to the next construct.
+
+        :returns: The ``(start, end)`` position of the ``#include`` line that
+          was found, or ``None``.
+        """
+        extype, match = self.scan_regex.search(self.text, self.pos)
         if extype is None:
             self.pos = len(self.text)
-            return
+            return None
         self.pos = match.end()
 
-        if extype != self.regex.types.preproc:
-            return
+        if extype != self.scan_regex.types.preproc:
+            return None
         preproc_start = self.text.index(b"#", match.start()) + 1
+        directive = self.preproc_directive_regex.match(
+            self.text, preproc_start,
+        )
+        if directive is None:
+            return None
 
-        if self.preproc_if_regex.match(self.text, preproc_start):
+        if directive.lastgroup == "if":
             self.preproc_if(preproc_start)
-            return
+            return None
 
-        if self.preproc_endif_regex.match(self.text, preproc_start):
+        if directive.lastgroup == "endif":
             self.preproc_endif()
-            return
+            return None
 
-        if not self.preproc_include_regex.match(self.text, preproc_start):
-            return
-        if not self.in_header_block:
-            self.includes.append((match.start(), self.pos))
+        if self.in_header_block:
+            return None
+        return (match.start(), self.pos)
+
+    def iter_includes(self):
+        """Like :meth:`parse`, but yields each ``#include`` as soon as it is
+        found.
+        """
+        length = len(self.text)
+        while self.pos < length:
+            include = self.parse_iter()
+            if include is not None:
+                yield include
 
     def parse(self):
-        while self.pos < len(self.text):
-            self.parse_iter()
+        self.includes.extend(self.iter_includes())
         return self.includes
 
     def error(self, message, pos=None):
@@ -154,6 +181,14 @@ class IncludeParser:
         raise PreCPPParseError.with_header(message, coords)
 
 
+# Used instead of `IncludeParser.regex` for text that doesn't contain any
+# comments.
+IncludeParser.regex_no_comments = OrRegex({
+    name: pattern for name, pattern in IncludeParser.expressions.items()
+    if not name.endswith("_comment")
+}, re.DOTALL, first_chars=b"\"'# \t\r\v\f")
+
+
 keep_include_regex = re.compile(rb"""
     (
         (// \s* %s) |           # Matches, e.g., "// @include"
@@ -162,8 +197,12 @@ keep_include_regex = re.compile(rb"""
 """ % ((re.escape(INCLUDE_COMMENT),) * 2), re.VERBOSE)
 
 
-def should_keep_include(line):
-    return bool(keep_include_regex.search(line))
+def should_keep_include(text, start=0, end=None):
+    """Checks whether the ``#include`` line in ``text[start:end]`` should be
+    kept. The text isn't sliced, so no copy is made.
+    """
+    end = len(text) if end is None else end
+    return bool(keep_include_regex.search(text, start, end))
 
 
 def replace_includes(text: bytes) -> bytes:
@@ -172,15 +211,17 @@ def replace_includes(text: bytes) -> bytes:
     See "Header generation" in the README for exactly which ``#include``
     statements are removed.
     """
-    includes = IncludeParser(text).parse()
+    view = memoryview(text)
     parts = []
     pos = 0
-    for start, end in includes:
-        if should_keep_include(text[start:end]):
+    # Each include is handled as soon as it's found, rather than after the
+    # whole file has been scanned.
+    for start, end in IncludeParser(text).iter_includes():
+        if should_keep_include(text, start, end):
             continue
-        parts.append(text[pos:start])
+        parts.append(view[pos:start])
         pos = end
-    parts.append(text[pos:])
+    parts.append(view[pos:])
     return b"".join(parts)
 
 
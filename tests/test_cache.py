@@ -0,0 +1,158 @@
+# Copyright (C) 2018 taylor.fish <contact@taylor.fish>
+#
+# This file is part of autoheaders.
+#
+# autoheaders is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# autoheaders is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
+
+from autoheaders import autoheaders, cache
+from unittest import mock
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+C_TEXT = b"""\
+#include "foo.h" // @include
+foo_t get_foo(void) { return 1; }
+"""
+
+
+@unittest.skipUnless(shutil.which("gcc"), "gcc is required")
+class CPPCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.project_dir = os.path.join(tmp.name, "project")
+        self.cache_dir = os.path.join(tmp.name, "cache")
+        os.makedirs(os.path.join(self.project_dir, "inc"))
+        self.c_path = os.path.join(self.project_dir, "a.c")
+        self.write("a.c", C_TEXT)
+        self.write("inc/foo.h", b"typedef int foo_t;\n")
+
+        env = mock.patch.dict(os.environ, {
+            "XDG_CACHE_HOME": self.cache_dir,
+            "AUTOHEADERS_CACHE": "1",
+            "AUTOHEADERS_CPP": "gcc -E",
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        for name in autoheaders.INCLUDE_PATH_ENV_VARS:
+            os.environ.pop(name, None)
+
+    def write(self, name, text):
+        with open(os.path.join(self.project_dir, name), "wb") as f:
+            f.write(text)
+
+    def preprocess(self):
+        """Preprocesses a.c and returns whether the cache was used.
+        """
+        real_run = subprocess.run
+        calls = []
+        self.cpp_calls = calls
+
+        def run(args, *a, **kw):
+            calls.append(args)
+            return real_run(args, *a, **kw)
+
+        with mock.patch.object(autoheaders.subprocess, "run", run):
+            output = autoheaders.preprocess(self.c_path, C_TEXT, ["-Iinc"])
+        self.assertIn(b"get_foo", output)
+        # The real preprocessor run is the one without "-v".
+        return not any("-v" not in args for args in calls)
+
+    def cache_entries(self):
+        path = os.path.join(
+            self.cache_dir, "autoheaders", autoheaders.CPP_CACHE_NAMESPACE,
+        )
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def test_hit(self):
+        self.assertFalse(self.preprocess())
+        self.assertEqual(len(self.cache_entries()), 1)
+        self.assertTrue(self.preprocess())
+
+    def test_search_dirs_cached(self):
+        self.preprocess()
+        self.write("inc/foo.h", b"typedef long foo_t;\n")
+        self.assertFalse(self.preprocess())
+        # Only the first miss needs to run the preprocessor with "-v".
+        self.assertFalse(any("-v" in args for args in self.cpp_calls))
+        os.environ["CPATH"] = self.project_dir
+        self.preprocess()
+        self.assertTrue(any("-v" in args for args in self.cpp_calls))
+
+    def test_disabled(self):
+        os.environ["AUTOHEADERS_CACHE"] = "0"
+        self.assertFalse(self.preprocess())
+        self.assertFalse(self.preprocess())
+        self.assertEqual(self.cache_entries(), [])
+
+    def test_disabled_by_default(self):
+        del os.environ["AUTOHEADERS_CACHE"]
+        self.assertFalse(self.preprocess())
+        self.assertEqual(self.cache_entries(), [])
+
+    def test_included_file_changed(self):
+        self.preprocess()
+        self.write("inc/foo.h", b"typedef long foo_t;\n")
+        self.assertFalse(self.preprocess())
+
+    def test_included_file_shadowed(self):
+        self.preprocess()
+        # Found before inc/foo.h, as quoted includes are looked up in the
+        # C file's directory first.
+        self.write("foo.h", b"typedef long foo_t;\n")
+        self.assertFalse(self.preprocess())
+
+    def test_included_file_shadowed_in_subdir(self):
+        os.makedirs(os.path.join(self.project_dir, "inc", "sub"))
+        os.makedirs(os.path.join(self.project_dir, "sub"))
+        self.write("inc/sub/foo.h", b"typedef int foo_t;\n")
+        self.write("inc/foo.h", b'#include "sub/foo.h"\n')
+        self.preprocess()
+        self.write("sub/foo.h", b"typedef long foo_t;\n")
+        self.assertFalse(self.preprocess())
+
+    def test_unrelated_file_added(self):
+        self.preprocess()
+        # Creating files (e.g., other headers, or an editor's temporary
+        # files) doesn't invalidate the cache unless they'd be included.
+        self.write("b.h", b"typedef long foo_t;\n")
+        self.write("inc/bar.h", b"typedef long foo_t;\n")
+        self.assertTrue(self.preprocess())
+
+    def test_include_path_env_var_changed(self):
+        self.preprocess()
+        os.environ["CPATH"] = self.project_dir
+        self.assertFalse(self.preprocess())
+
+    def test_eviction(self):
+        with mock.patch.object(cache, "MAX_NAMESPACE_SIZE", 10):
+            cache.put("test", "a", b"12345")
+            cache.put("test", "b", b"12345")
+            os.utime(cache._get_path("test", "a"), (1, 1))
+            os.utime(cache._get_path("test", "b"), (2, 2))
+            # Marks "a" as recently used.
+            self.assertEqual(cache.get("test", "a"), b"12345")
+            cache.put("test", "c", b"12345")
+        # "b" was the least recently used item.
+        self.assertEqual(cache.get("test", "b"), None)
+        self.assertEqual(cache.get("test", "a"), b"12345")
+        self.assertEqual(cache.get("test", "c"), b"12345")
+
+
+if __name__ == "__main__":
+    unittest.main()
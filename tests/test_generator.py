@@ -0,0 +1,53 @@
+# Copyright (C) 2018 taylor.fish <contact@taylor.fish>
+#
+# This file is part of autoheaders.
+#
+# autoheaders is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# autoheaders is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
+
+from autoheaders.generator import HeaderGenerator
+import gc
+import io
+import unittest
+import weakref
+
+C_TEXT = b"""\
+int get_value(void) {
+    return 1;
+}
+static int counter;
+"""
+
+PREPROCESSED = b'# 1 "<stdin>"\n' + C_TEXT
+
+
+class HeaderGeneratorTest(unittest.TestCase):
+    def test_headers(self):
+        gen = HeaderGenerator(C_TEXT, PREPROCESSED)
+        public, private = io.BytesIO(), io.BytesIO()
+        gen.write_all(public, private=False)
+        gen.write_all(private, private=True)
+        self.assertEqual(public.getvalue(), b"int get_value(void);\n")
+        self.assertEqual(private.getvalue(), b"static int counter;\n")
+
+    def test_ast_released(self):
+        gen = HeaderGenerator(C_TEXT, PREPROCESSED)
+        ast = weakref.ref(gen._ast)
+        gen.write_all(io.BytesIO())
+        gc.collect()
+        self.assertIsNone(ast())
+        self.assertIsNone(gen.preprocessed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# Copyright (C) 2018 taylor.fish <contact@taylor.fish>
+#
+# This file is part of autoheaders.
+#
+# autoheaders is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# autoheaders is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with autoheaders.  If not, see <http://www.gnu.org/licenses/>.
+
+from autoheaders.errors import AutoheadersError
+from autoheaders.main import ArgParser, get_default_outpath, run
+from unittest import mock
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+class MultiFileArgsTest(unittest.TestCase):
+    def parse(self, *args):
+        with mock.patch("sys.stderr"):
+            return ArgParser(list(args)).parse()
+
+    def test_multiple_files(self):
+        parsed = self.parse("a.c", "-p", "b.c")
+        self.assertIsNone(parsed.parse_error)
+        self.assertEqual(parsed.c_files, ["a.c", "b.c"])
+        self.assertTrue(parsed.private)
+
+    def test_outfile_rejected(self):
+        parsed = self.parse("-o", "a.h", "a.c", "b.c")
+        self.assertIn('"-o"', parsed.parse_error.message)
+
+    def test_stdin_rejected(self):
+        parsed = self.parse("a.c", "-")
+        self.assertIn('"-"', parsed.parse_error.message)
+
+    def test_duplicate_file_rejected(self):
+        parsed = self.parse("a.c", "./a.c")
+        self.assertIn("more than once", parsed.parse_error.message)
+
+    def test_overwriting_input_rejected(self):
+        parsed = self.parse("a.c", "hdr.h")
+        self.assertIn("overwritten", parsed.parse_error.message)
+        parsed = self.parse("a.c", "a.h")
+        self.assertIn("overwritten", parsed.parse_error.message)
+
+    def test_same_outpath_rejected(self):
+        parsed = self.parse("a.c", "a.cc")
+        self.assertIn('"a.h"', parsed.parse_error.message)
+        self.assertIsNone(self.parse("-p", "a.h", "b.c").parse_error)
+
+    def test_default_outpath(self):
+        self.assertEqual(get_default_outpath("dir/a.c", False), "dir/a.h")
+        self.assertEqual(
+            get_default_outpath("dir/a.c", True), "dir/a.priv.h",
+        )
+
+
+@unittest.skipUnless(
+    shutil.which("gcc") or shutil.which("clang"),
+    "a C preprocessor is required",
+)
+class MultiFileRunTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        env = mock.patch.dict(os.environ, {"AUTOHEADERS_CACHE": "0"})
+        env.start()
+        self.addCleanup(env.stop)
+        for name in ["a", "b"]:
+            with open(self.path(name + ".c"), "w") as f:
+                f.write(
+                    "int {0}_public(void) {{ return 0; }}\n"
+                    "static int {0}_private(void) {{ return 0; }}\n"
+                    .format(name)
+                )
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def run_args(self, *args):
+        with mock.patch("sys.stderr"):
+            parsed = ArgParser(list(args)).parse()
+        self.assertIsNone(parsed.parse_error)
+        run(parsed)
+
+    def test_public_headers(self):
+        self.run_args(self.path("a.c"), self.path("b.c"))
+        self.assertEqual(self.read("a.h"), "int a_public(void);\n")
+        self.assertEqual(self.read("b.h"), "int b_public(void);\n")
+        self.assertFalse(os.path.exists(self.path("a.priv.h")))
+
+    def test_private_headers(self):
+        self.run_args("-p", self.path("a.c"), self.path("b.c"))
+        self.assertEqual(
+            self.read("a.priv.h"), "static int a_private(void);\n",
+        )
+        self.assertEqual(
+            self.read("b.priv.h"), "static int b_private(void);\n",
+        )
+        self.assertFalse(os.path.exists(self.path("a.h")))
+
+    def test_errors_are_aggregated(self):
+        with self.assertRaises(AutoheadersError) as cm:
+            self.run_args(
+                self.path("a.c"), self.path("missing1.c"),
+                self.path("missing2.c"),
+            )
+        message = cm.exception.message
+        self.assertIn(self.path("missing1.c"), message)
+        self.assertIn(self.path("missing2.c"), message)
+        self.assertNotIn("Traceback", message)
+        # Headers are still generated for the other files.
+        self.assertEqual(self.read("a.h"), "int a_public(void);\n")
+
+    def test_debug_includes_tracebacks(self):
+        with self.assertRaises(AutoheadersError) as cm:
+            self.run_args(
+                "--debug", self.path("a.c"), self.path("missing.c"),
+            )
+        message = cm.exception.message
+        self.assertIn("Traceback", message)
+        self.assertIn("AutoheadersFileNotFoundError", message)
+
+
+if __name__ == "__main__":
+    unittest.main()